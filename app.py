@@ -1,19 +1,22 @@
 # app.py
-from flask import Flask, request, render_template, redirect, url_for
+from flask import Flask, Response, request, render_template, redirect, url_for
 from flask_restx import Api, Resource, fields
-import uuid
 import json
 import os
 from datetime import datetime
-import pandas as pd
-import openai
-from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+import payload
+import uploads
+from compliance_engine import get_engine
+from singleflight import SingleFlight
+
 # Fixed API key to be used across the application
 FIXED_API_KEY = "550e8400-e29b-41d4-a716-446655440000"
 
 app = Flask(__name__)
+# File parts are hashed and written to UPLOAD_DIR as the request body arrives (see uploads.UploadRequest)
+app.request_class = uploads.UploadRequest
 
 # Initialize Flask-RESTX API with doc='/swagger' to set Swagger UI at /swagger
 api = Api(app,
@@ -33,16 +36,31 @@ load_dotenv()
 CUSTOMERS_FILE = os.path.join(DATA_DIR, "customers.json")  # For onboarding demo
 UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")  # Fixed typo: was 'Angstroms'
 
-# Ensure the data and upload directories exist
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-if not os.path.exists(UPLOAD_DIR):
-    os.makedirs(UPLOAD_DIR)
+# Whole-request cap (BOL, invoice, POA and up to 5 PGA documents); per-file limit is uploads.MAX_UPLOAD_BYTES
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_REQUEST_BYTES", str(8 * uploads.MAX_UPLOAD_BYTES)))
+app.config['UPLOAD_DIR'] = UPLOAD_DIR
+app.config['MAX_UPLOAD_BYTES'] = uploads.MAX_UPLOAD_BYTES
 
-# Initialize the JSON files if they don't exist
-if not os.path.exists(CUSTOMERS_FILE):
-    with open(CUSTOMERS_FILE, 'w') as f:
-        json.dump({}, f)
+_storage_ready = False
+
+
+# Ensure the data and upload directories and the JSON files exist.
+# Runs on the first request instead of at import so workers start quickly.
+@app.before_request
+def ensure_storage():
+    global _storage_ready
+    if _storage_ready:
+        return
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    if not os.path.exists(CUSTOMERS_FILE):
+        with open(CUSTOMERS_FILE, 'w') as f:
+            json.dump({}, f)
+    _storage_ready = True
+
+
+@app.teardown_request
+def discard_uploads(exc=None):
+    request.discard_uploads()
 
 
 # Helper function to read customer profile for a specific scenario
@@ -96,64 +114,16 @@ def check_denied_party_list(consignee_name):
     return consignee_name in denied_parties
 
 
-# Ported from main.py: Utility function to validate URLs
-def is_valid_url(url: str) -> bool:
-    parsed = urlparse(url.strip())
-    return parsed.scheme in ("http", "https") and bool(parsed.netloc)
+# Concurrent shipments for the same HS code share one in-flight PGA lookup
+lookup_flight = SingleFlight("lookup")
 
 
-# Ported from main.py: PGA Lookup Logic
+# PGA Lookup Logic (reference data comes from the shared compliance engine)
 def lookup_pga_requirements(hs_code, name, description):
-    target = hs_code
-
-    # HS Chapters
-    df_chapters = pd.read_excel(os.path.join(DATA_DIR, "HS_Chapters_lookup.xlsx"))
-    df_chapters["Chapter"] = df_chapters["Chapter"].astype(str).str.zfill(2)
-    df_chapters = df_chapters.ffill().bfill()
-    chapter_key = target[:2].zfill(2)
-    chapters = df_chapters[df_chapters["Chapter"] == chapter_key] \
-        .replace("", pd.NA).dropna(axis=1, how="all") \
-        .to_dict(orient="records")
-
-    # PGA_HTS + PGA_Codes
-    df_hts = pd.read_excel(os.path.join(DATA_DIR, "PGA_HTS.xlsx"), dtype=str) \
-        .rename(columns={"HTS Number - Full": "HsCode"})
-    df_pga = pd.read_excel(os.path.join(DATA_DIR, "PGA_codes.xlsx"))
-    pga_hts = (
-        df_hts.merge(df_pga, how="left",
-                     left_on=["PGA Name Code", "PGA Flag Code", "PGA Program Code"],
-                     right_on=["Agency Code", "Code", "Program Code"])
-        .replace("", pd.NA).dropna(axis=1, how="all")
-    )
-    pga_hts = pga_hts[pga_hts["HsCode"] == target].to_dict(orient="records")
-
-    # HS Rules
-    sheets = pd.read_excel(os.path.join(DATA_DIR, "hs_codes.xlsx"), sheet_name=None)
-    df_rules = pd.concat(sheets.values(), ignore_index=True)
-    df_rules["HsCode"] = df_rules["HsCode"].astype(str)
-    df_rules["Chapter"] = df_rules["HsCode"].str[:2].str.zfill(2)
-    df_rules["Header"] = df_rules["HsCode"].str[:4]
-    hs_rules = df_rules[df_rules["HsCode"].str.startswith(target)]
-    if hs_rules.empty:
-        hs_rules = df_rules[df_rules["HsCode"].str.startswith(target[:4])]
-    if hs_rules.empty:
-        hs_rules = df_rules[df_rules["Chapter"] == chapter_key]
-    hs_rules = hs_rules.replace("", pd.NA).dropna(axis=1, how="all") \
-        .to_dict(orient="records")
-
-    # Build a unique set of only valid HTTP(S) links
-    links = set()
-    for rec in pga_hts:
-        for col in ("TextLink", "Website Link", "CFR"):
-            raw = rec.get(col)
-            if raw is None or pd.isna(raw):
-                continue
-            for url in str(raw).split():
-                if is_valid_url(url):
-                    links.add(url)
+    result = get_engine().lookup(hs_code)
 
     requirements = []
-    for url in sorted(links):
+    for url in result["links"]:
         # Mock response instead of calling OpenAI
         requirements.append({
             "url": url,
@@ -161,11 +131,10 @@ def lookup_pga_requirements(hs_code, name, description):
             "parsed_requirements": "Mocked response: Required documents - Certificate of Compliance, Safety Data Sheet (if applicable)."
         })
 
-    pga_flags = [rec.get("PGA Name Code") for rec in pga_hts if rec.get("PGA Name Code")]
-    return list(set(pga_flags)), {
-        "hs_chapters": chapters,
-        "pga_hts": pga_hts,
-        "hs_rules": hs_rules,
+    return result["pga_flags"], {
+        "hs_chapters": result["hs_chapters"],
+        "pga_hts": result["pga_hts"],
+        "hs_rules": result["hs_rules"],
         "pga_requirements": requirements
     }
 
@@ -181,6 +150,7 @@ def home():
 def onboard():
     api_token = None
     success = False
+    error_message = None
     customers = read_customers()
     existing_customer = None
     existing_api_token = None
@@ -252,10 +222,11 @@ def onboard():
             if 'poa_file' in request.files:
                 poa_file = request.files['poa_file']
                 if poa_file and poa_file.filename.endswith('.pdf'):
-                    # Save the file with a unique name
-                    filename = f"{uuid.uuid4()}_{poa_file.filename}"
-                    poa_file_path = os.path.join(UPLOAD_DIR, filename)
-                    poa_file.save(poa_file_path)
+                    # Stored once per distinct content
+                    try:
+                        poa_file_path = uploads.save_upload(poa_file, UPLOAD_DIR)
+                    except uploads.UploadTooLarge as e:
+                        error_message = e.description
 
         # Status
         status = request.form['status']
@@ -280,33 +251,35 @@ def onboard():
             'status': status
         })
 
-        # Load existing customers and clear them (for demo purposes, we only allow one customer)
-        customers = {}
-
-        # Store customer data with the fixed API token
-        customers[api_token] = {
-            'company_name': company_name,
-            'address': address,
-            'contact': contact,
-            'is_importer_of_record': is_importer_of_record,
-            'has_poa': has_poa,
-            'poa_expiry_date': poa_expiry_date,
-            'poa_file_path': poa_file_path,
-            'status': status,
-            'created_at': datetime.utcnow().isoformat()
-        }
+        if not error_message:
+            # Load existing customers and clear them (for demo purposes, we only allow one customer)
+            customers = {}
+
+            # Store customer data with the fixed API token
+            customers[api_token] = {
+                'company_name': company_name,
+                'address': address,
+                'contact': contact,
+                'is_importer_of_record': is_importer_of_record,
+                'has_poa': has_poa,
+                'poa_expiry_date': poa_expiry_date,
+                'poa_file_path': poa_file_path,
+                'status': status,
+                'created_at': datetime.utcnow().isoformat()
+            }
 
-        # Save updated customers to file
-        write_customers(customers)
-        success = True
+            # Save updated customers to file
+            write_customers(customers)
+            success = True
 
-        # Update existing customer for display
-        existing_customer = customers[api_token]
-        existing_api_token = api_token
+            # Update existing customer for display
+            existing_customer = customers[api_token]
+            existing_api_token = api_token
 
     return render_template('onboard.html',
                            api_token=api_token,
                            success=success,
+                           error_message=error_message,
                            existing_customer=existing_customer,
                            existing_api_token=existing_api_token,
                            form_data=form_data)
@@ -317,10 +290,8 @@ def onboard():
 def delete_customer(api_token):
     customers = read_customers()
     if api_token in customers:
-        # Delete any uploaded POA file if it exists
-        customer = customers[api_token]
-        if customer.get('poa_file_path') and os.path.exists(customer['poa_file_path']):
-            os.remove(customer['poa_file_path'])
+        # The POA file is left in place: uploads are stored once per content, so the same file can back
+        # another customer's POA or a shipment's BOL, invoice or PGA document
         # Remove the customer
         del customers[api_token]
         write_customers(customers)
@@ -415,30 +386,26 @@ def shipment_form(scenario=None):
             commercial_invoice_path = None
             pga_documents = []
 
-            if 'bol_file' in request.files:
-                bol_file = request.files['bol_file']
-                if bol_file and bol_file.filename and bol_file.filename.endswith('.pdf'):
-                    filename = f"bol_{uuid.uuid4()}_{bol_file.filename}"
-                    bol_file_path = os.path.join(UPLOAD_DIR, filename)
-                    bol_file.save(bol_file_path)
-
-            if 'commercial_invoice' in request.files:
-                commercial_invoice = request.files['commercial_invoice']
-                if commercial_invoice and commercial_invoice.filename and commercial_invoice.filename.endswith('.pdf'):
-                    filename = f"invoice_{uuid.uuid4()}_{commercial_invoice.filename}"
-                    commercial_invoice_path = os.path.join(UPLOAD_DIR, filename)
-                    commercial_invoice.save(commercial_invoice_path)
-
-            # Handle up to 5 PGA document uploads
-            for i in range(1, 6):
-                field_name = f'pga_document_{i}'
-                if field_name in request.files:
-                    pga_doc = request.files[field_name]
-                    if pga_doc and pga_doc.filename and pga_doc.filename.endswith('.pdf'):
-                        filename = f"pga_doc_{uuid.uuid4()}_{pga_doc.filename}"
-                        pga_doc_path = os.path.join(UPLOAD_DIR, filename)
-                        pga_doc.save(pga_doc_path)
-                        pga_documents.append(pga_doc_path)
+            try:
+                if 'bol_file' in request.files:
+                    bol_file = request.files['bol_file']
+                    if bol_file and bol_file.filename and bol_file.filename.endswith('.pdf'):
+                        bol_file_path = uploads.save_upload(bol_file, UPLOAD_DIR)
+
+                if 'commercial_invoice' in request.files:
+                    commercial_invoice = request.files['commercial_invoice']
+                    if commercial_invoice and commercial_invoice.filename and commercial_invoice.filename.endswith('.pdf'):
+                        commercial_invoice_path = uploads.save_upload(commercial_invoice, UPLOAD_DIR)
+
+                # Handle up to 5 PGA document uploads
+                for i in range(1, 6):
+                    field_name = f'pga_document_{i}'
+                    if field_name in request.files:
+                        pga_doc = request.files[field_name]
+                        if pga_doc and pga_doc.filename and pga_doc.filename.endswith('.pdf'):
+                            pga_documents.append(uploads.save_upload(pga_doc, UPLOAD_DIR))
+            except uploads.UploadTooLarge as e:
+                error_message = e.description
 
             shipment_data = {
                 'shipper_id': request.form['shipper_id'],
@@ -456,7 +423,7 @@ def shipment_form(scenario=None):
             }
 
             # Scenario 3: Check IOR/POA status
-            if not customer['is_importer_of_record'] and not customer['has_poa']:
+            if not error_message and not customer['is_importer_of_record'] and not customer['has_poa']:
                 error_message = "Customer is not an Importer of Record and has no Power of Attorney filed on account."
 
             # Scenario 4: Check denied party list
@@ -495,8 +462,9 @@ def shipment_form(scenario=None):
                         success_message = f"No HS code provided. Assigned HS code: {hts_code} by internal service."
 
                 # Step 3: Check PGA flags using the internal service
-                pga_flags, pga_full_response = lookup_pga_requirements(hts_code, shipment_data['consignee_name'],
-                                                                       shipment_data['description'])
+                pga_flags, pga_full_response = lookup_flight.do(
+                    (hts_code, shipment_data['consignee_name'], shipment_data['description']),
+                    lookup_pga_requirements, hts_code, shipment_data['consignee_name'], shipment_data['description'])
                 if not pga_flags:  # Fallback to mock if service fails
                     pga_flags = mock_pga_flags(hts_code)
 
@@ -574,12 +542,19 @@ class ShipmentResource(Resource):
     @ns.response(200, 'Success', response_model)
     @ns.response(400, 'Bad Request')
     @ns.response(401, 'Unauthorized')
+    @ns.param('view', 'Response view: flags, summary or full (default)', enum=list(payload.VIEWS))
+    @ns.param('fields', 'Comma-separated top-level fields to return')
     def post(self):
         """Submit a shipment for Type 86 processing with fallback to Type 11"""
         api_token = request.headers.get('Authorization')
         if not api_token:
             return {'error': 'API token required'}, 401
 
+        view = request.args.get('view', 'full')
+        if view not in payload.VIEWS:
+            return {'error': f"Invalid view '{view}', expected one of: {', '.join(payload.VIEWS)}"}, 400
+        response_fields = payload.parse_fields(request.args.get('fields'))
+
         shipment_data = request.json
         if not shipment_data:
             return {'error': 'Shipment data required'}, 400
@@ -623,8 +598,9 @@ class ShipmentResource(Resource):
             shipment_data['description'])
 
         # Check PGA flags
-        pga_flags, pga_full_response = lookup_pga_requirements(hts_code, shipment_data['consignee_name'],
-                                                               shipment_data['description'])
+        pga_flags, pga_full_response = lookup_flight.do(
+            (hts_code, shipment_data['consignee_name'], shipment_data['description']),
+            lookup_pga_requirements, hts_code, shipment_data['consignee_name'], shipment_data['description'])
         if not pga_flags:
             pga_flags = mock_pga_flags(hts_code)
 
@@ -638,7 +614,57 @@ class ShipmentResource(Resource):
             'pga_full_response': pga_full_response,
             'shipment': shipment_data
         }
-        return response, 200
+        body = payload.dumps(payload.shape_response(response, view, response_fields))
+        return Response(body, status=200, mimetype='application/json')
+
+
+# Reference blocks (hs_chapters, pga_hts, hs_rules) sent by ID in the summary view
+@ns.route('/reference/<string:ref_id>')
+class ReferenceResource(Resource):
+    @ns.doc('get_reference')
+    @ns.response(200, 'Success')
+    @ns.response(304, 'Not Modified')
+    @ns.response(404, 'Not Found')
+    def get(self, ref_id):
+        """Fetch a reference block by ID; the ID is also its ETag"""
+        body = payload.resolve_reference(ref_id, get_engine().lookup)
+        if body is None:
+            return {'error': 'Reference not found or out of date'}, 404
+        headers = {'ETag': f'"{ref_id}"', 'Cache-Control': 'public, max-age=86400, immutable'}
+        if ref_id in request.if_none_match:
+            return Response(status=304, headers=headers)
+        return Response(body, status=200, mimetype='application/json', headers=headers)
+
+
+# Batch HS lookup (reference data and PGA flags only), same engine entry point as the FastAPI /lookup-batch
+lookup_batch_model = api.model('LookupBatch', {
+    'hs_codes': fields.List(fields.String, required=True, description='HS codes to look up')
+})
+
+
+@ns.route('/lookup-batch')
+class LookupBatchResource(Resource):
+    @ns.doc('lookup_batch')
+    @ns.expect(lookup_batch_model)
+    @ns.response(200, 'Success')
+    @ns.response(400, 'Bad Request')
+    def post(self):
+        """Look up reference data and PGA flags for several HS codes, keyed by code"""
+        hs_codes = (request.json or {}).get('hs_codes')
+        if not isinstance(hs_codes, list):
+            return {'error': 'hs_codes list required'}, 400
+        hs_codes = [str(code).replace('.', '') for code in hs_codes]
+        body = payload.dumps(get_engine().lookup_many(hs_codes))
+        return Response(body, status=200, mimetype='application/json')
+
+
+# Service counters (request coalescing)
+@ns.route('/metrics')
+class MetricsResource(Resource):
+    @ns.doc('metrics')
+    def get(self):
+        """Return in-process service counters"""
+        return {'coalescing': {'lookup': lookup_flight.stats()}, 'uploads': uploads.stats()}, 200
 
 
 # Define security for Swagger (API token in header)
@@ -0,0 +1,138 @@
+# compliance_engine.py
+# HS/PGA reference lookup shared by the Flask app (app.py) and the FastAPI app (main.py).
+# The Excel workbooks are read once and indexed; lookups after that are dictionary hits.
+import os
+import threading
+from urllib.parse import urlparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+LINK_COLUMNS = ("TextLink", "Website Link", "CFR")
+RULES_CACHE_SIZE = 4096
+
+
+def is_valid_url(url: str) -> bool:
+    parsed = urlparse(url.strip())
+    return parsed.scheme in ("http", "https") and bool(parsed.netloc)
+
+
+def _records(df, pd):
+    return df.replace("", pd.NA).dropna(axis=1, how="all").to_dict(orient="records")
+
+
+def _links(records, pd):
+    # Unique, sorted set of only valid HTTP(S) links
+    links = set()
+    for rec in records:
+        for col in LINK_COLUMNS:
+            raw = rec.get(col)
+            if raw is None or pd.isna(raw):
+                continue
+            for url in str(raw).split():
+                if is_valid_url(url):
+                    links.add(url)
+    return sorted(links)
+
+
+class ComplianceEngine:
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._chapters = {}
+        self._pga_hts = {}
+        self._links = {}
+        self._rules_cache = {}
+        self._df_rules = None
+
+    def load(self):
+        """Read the workbooks and build the indexes; safe to call from several threads."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            import pandas as pd  # deferred: keeps app start-up free of pandas/openpyxl
+
+            # HS Chapters, indexed by two-digit chapter
+            df_chapters = pd.read_excel(os.path.join(self.data_dir, "HS_Chapters_lookup.xlsx"))
+            df_chapters["Chapter"] = df_chapters["Chapter"].astype(str).str.zfill(2)
+            df_chapters = df_chapters.ffill().bfill()
+            self._chapters = {key: _records(group, pd) for key, group in df_chapters.groupby("Chapter")}
+
+            # PGA_HTS + PGA_Codes, indexed by full HS code
+            df_hts = pd.read_excel(os.path.join(self.data_dir, "PGA_HTS.xlsx"), dtype=str) \
+                .rename(columns={"HTS Number - Full": "HsCode"})
+            df_pga = pd.read_excel(os.path.join(self.data_dir, "PGA_codes.xlsx"))
+            pga_hts = (
+                df_hts.merge(df_pga, how="left",
+                             left_on=["PGA Name Code", "PGA Flag Code", "PGA Program Code"],
+                             right_on=["Agency Code", "Code", "Program Code"])
+                .replace("", pd.NA).dropna(axis=1, how="all")
+            )
+            self._pga_hts = {key: group.to_dict(orient="records") for key, group in pga_hts.groupby("HsCode")}
+            self._links = {key: _links(records, pd) for key, records in self._pga_hts.items()}
+
+            # HS Rules, all sheets
+            sheets = pd.read_excel(os.path.join(self.data_dir, "hs_codes.xlsx"), sheet_name=None)
+            df_rules = pd.concat(sheets.values(), ignore_index=True)
+            df_rules["HsCode"] = df_rules["HsCode"].astype(str)
+            df_rules["Chapter"] = df_rules["HsCode"].str[:2].str.zfill(2)
+            df_rules["Header"] = df_rules["HsCode"].str[:4]
+            self._df_rules = df_rules
+            self._loaded = True
+
+    def _hs_rules(self, target, chapter_key):
+        with self._lock:
+            cached = self._rules_cache.get(target)
+        if cached is not None:
+            return cached
+
+        import pandas as pd
+
+        df_rules = self._df_rules
+        hs_rules = df_rules[df_rules["HsCode"].str.startswith(target)]
+        if hs_rules.empty:
+            hs_rules = df_rules[df_rules["HsCode"].str.startswith(target[:4])]
+        if hs_rules.empty:
+            hs_rules = df_rules[df_rules["Chapter"] == chapter_key]
+        records = _records(hs_rules, pd)
+
+        with self._lock:
+            if len(self._rules_cache) >= RULES_CACHE_SIZE:
+                self._rules_cache.pop(next(iter(self._rules_cache)))
+            self._rules_cache[target] = records
+        return records
+
+    def lookup(self, hs_code):
+        """Reference data, PGA flags and agency links for one HS code."""
+        self.load()
+        target = str(hs_code)
+        chapter_key = target[:2].zfill(2)
+        pga_hts = self._pga_hts.get(target, [])
+        # Records are shared between callers, so hand out copies
+        return {
+            "hs_chapters": [dict(rec) for rec in self._chapters.get(chapter_key, [])],
+            "pga_hts": [dict(rec) for rec in pga_hts],
+            "hs_rules": [dict(rec) for rec in self._hs_rules(target, chapter_key)],
+            "links": list(self._links.get(target, [])),
+            "pga_flags": list(dict.fromkeys(rec.get("PGA Name Code") for rec in pga_hts if rec.get("PGA Name Code"))),
+        }
+
+    def lookup_many(self, hs_codes):
+        """Batch entry point: one result per distinct HS code, keyed by code."""
+        return {code: self.lookup(code) for code in dict.fromkeys(str(c) for c in hs_codes)}
+
+
+_default_engine = None
+_default_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _default_engine
+    if _default_engine is None:
+        with _default_engine_lock:
+            if _default_engine is None:
+                _default_engine = ComplianceEngine()
+    return _default_engine
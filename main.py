@@ -1,15 +1,23 @@
 import os
-import pandas as pd
+import asyncio
+import hashlib
+import time
 import requests
 import logging
-import openai
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from fastapi.responses import HTMLResponse
-from urllib.parse import urlparse
+from fastapi.responses import HTMLResponse, Response
+
+import payload
+from compliance_engine import get_engine
+from page_text import clean_page
+from singleflight import SingleFlight
+from openai_scheduler import BULK, INTERACTIVE, RateLimitScheduler, estimate_tokens
+from resilience import BreakerRegistry, CircuitOpenError, Deadline, DeadlineExceeded
 
 # Set base directory to the directory where main.py is located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,6 +30,38 @@ VALID_PASS = "secret123"
 
 security = HTTPBasic()
 
+SYSTEM_PROMPT = "You are a customs compliance expert understanding how the participate government agencies work. Able to identify and describe the compliance needs for a given product."
+
+# Concurrent /lookup calls for the same HS code share one page fetch and one completion per prompt
+fetch_flight = SingleFlight("fetch")
+extract_flight = SingleFlight("extract")
+
+# Outbound calls fail fast once a host keeps failing, and a whole /lookup never runs past its deadline
+LOOKUP_DEADLINE_SECONDS = float(os.getenv("LOOKUP_DEADLINE_SECONDS", "25"))
+CALL_TIMEOUT_SECONDS = 10
+OPENAI_HOST = "api.openai.com"
+breakers = BreakerRegistry()
+# Last successful requirement per (URL, product name, product description), served when its host or
+# OpenAI is unavailable; keyed like the extraction so one product never gets another's answer
+last_good_requirements = {}
+LAST_GOOD_SIZE = 1024
+
+_openai_client = None
+
+# All OpenAI calls queue here: per-minute request/token budgets, interactive lookups ahead of bulk jobs
+llm_scheduler = RateLimitScheduler(
+    requests_per_minute=int(os.getenv("OPENAI_RPM", "500")),
+    tokens_per_minute=int(os.getenv("OPENAI_TPM", "200000"))
+)
+# Calls waiting on that budget block a thread, so each lane gets its own pool: queued bulk extractions can
+# neither starve asyncio's default executor (page fetches, engine lookups) nor keep interactive calls from
+# reaching the scheduler
+OPENAI_WORKERS_PER_LANE = int(os.getenv("OPENAI_WORKERS_PER_LANE", "8"))
+llm_executors = {
+    INTERACTIVE: ThreadPoolExecutor(OPENAI_WORKERS_PER_LANE, thread_name_prefix="openai-interactive"),
+    BULK: ThreadPoolExecutor(OPENAI_WORKERS_PER_LANE, thread_name_prefix="openai-bulk")
+}
+
 def auth(credentials: HTTPBasicCredentials = Depends(security)):
     correct_username = credentials.username == VALID_USER
     correct_password = credentials.password == VALID_PASS
@@ -47,26 +87,126 @@ class LookupRequest(BaseModel):
     hs_code: str
     name: str | None = None
     description: str | None = None
+    bulk: bool = False  # bulk jobs yield the OpenAI budget to interactive lookups
+
+class BatchLookupRequest(BaseModel):
+    hs_codes: list[str]
 
 class UPCRequest(BaseModel):
     upc: str
 
-def is_valid_url(url: str) -> bool:
-    parsed = urlparse(url.strip())
-    return parsed.scheme in ("http", "https") and bool(parsed.netloc)
+def get_with_breaker(url: str, timeout: float) -> requests.Response:
+    # Only connection errors, timeouts, 5xx and 429 count against the host's breaker;
+    # a 4xx is a problem with this one URL and is raised outside it
+    def get():
+        resp = requests.get(url, timeout=timeout)
+        if resp.status_code >= 500 or resp.status_code == 429:
+            resp.raise_for_status()
+        return resp
+
+    resp = breakers.for_url(url).call(get)
+    resp.raise_for_status()
+    return resp
+
+
+def fetch_page(url: str, timeout: float) -> str:
+    return get_with_breaker(url, timeout).text
+
+
+def openai_client():
+    # Own client with SDK retries off: llm_scheduler does the (budgeted, deadline-aware) retrying.
+    # Honours OPENAI_API_KEY and OPENAI_BASE_URL, e.g. a local fake server in tests.
+    global _openai_client
+    if _openai_client is None:
+        import openai
+        _openai_client = openai.OpenAI(max_retries=0)
+    return _openai_client
+
+
+def is_openai_outage(error: Exception) -> bool:
+    # Same rule as get_with_breaker: connection errors, timeouts, 5xx and 429 mean OpenAI is in trouble;
+    # a 400 (e.g. context too long) or 401 is a problem with this request or our key
+    import openai
+    if isinstance(error, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+def extract_requirements(prompt: str, priority: int, timeout: float) -> str:
+    deadline_at = time.monotonic() + timeout
+    messages = [{"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}]
+    breaker = breakers.get(OPENAI_HOST)
+
+    # Budget is acquired outside the breaker, so local queueing timeouts never count as OpenAI failures
+    def create():
+        def attempt():
+            try:
+                return openai_client().chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    timeout=max(0.1, deadline_at - time.monotonic())
+                ), None
+            except Exception as e:
+                if is_openai_outage(e):
+                    raise
+                return None, e
+
+        resp, error = breaker.call(attempt)
+        if error is not None:
+            raise error
+        return resp
+
+    resp = llm_scheduler.call(create, tokens=estimate_tokens(messages), priority=priority, deadline=deadline_at)
+    return resp.choices[0].message.content
+
+
+async def run_with_deadline(deadline: Deadline, flight: SingleFlight, key: str, fn, *args, executor=None):
+    timeout = deadline.timeout(CALL_TIMEOUT_SECONDS)
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(flight.do_async(key, loop.run_in_executor, executor, fn, *args, timeout), timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+async def extract_with_deadline(deadline: Deadline, prompt: str, priority: int) -> str:
+    # Keyed by lane too: an interactive lookup never waits behind a bulk leader's priority and timeout
+    key = f"{priority}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+    return await run_with_deadline(deadline, extract_flight, key, extract_requirements, prompt, priority,
+                                   executor=llm_executors[priority])
+
+
+def say_hello() -> str:
+    # Runs in a worker thread, so the lazy openai import never blocks the event loop
+    messages = [{"role":"user","content":"Say hello"}]
+    completion = llm_scheduler.call(
+        openai_client().chat.completions.create,
+        tokens=estimate_tokens(messages),
+        model="gpt-4o-mini",
+        messages=messages
+    )
+    return completion.choices[0].message.content
 
 
 @app.get("/test-chatgpt")
 async def test_chatgpt():
     try:
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role":"user","content":"Say hello"}]
-        )
-        return {"chatgpt_response": completion.choices[0].message.content}
+        loop = asyncio.get_running_loop()
+        return {"chatgpt_response": await loop.run_in_executor(llm_executors[INTERACTIVE], say_hello)}
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/metrics")
+def metrics():
+    return {
+        "coalescing": {"fetch": fetch_flight.stats(), "extract": extract_flight.stats()},
+        "circuit_breakers": breakers.stats(),
+        "openai_scheduler": llm_scheduler.stats()
+    }
+
 @app.get("/list-data")
 def list_data():
     try:
@@ -88,8 +228,7 @@ async def lookup_upc(req: UPCRequest, username: str = Depends(auth)):
 
     url = f"https://api.barcodelookup.com/v3/products?key={BARCODE_API_KEY}&barcode={req.upc}"
     try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
+        resp = get_with_breaker(url, CALL_TIMEOUT_SECONDS)
     except Exception as e:
         logger.error("Error calling BarcodeLookup API", exc_info=True)
         raise HTTPException(status_code=502, detail=f"External API error: {str(e)}")
@@ -109,80 +248,65 @@ async def lookup_upc(req: UPCRequest, username: str = Depends(auth)):
 @app.post("/lookup")
 #async def lookup(req: LookupRequest, username: str = Depends(auth)):
 async def lookup(req: LookupRequest):
-    target = req.hs_code
-
-    # HS Chapters
-    df_chapters = pd.read_excel(f"{DATA_DIR}/HS_Chapters_lookup.xlsx")
-    df_chapters["Chapter"] = df_chapters["Chapter"].astype(str).str.zfill(2)
-    df_chapters = df_chapters.ffill().bfill()
-    chapter_key = target[:2].zfill(2)
-    chapters = df_chapters[df_chapters["Chapter"] == chapter_key] \
-        .replace("", pd.NA).dropna(axis=1, how="all") \
-        .to_dict(orient="records")
-
-    # PGA_HTS + PGA_Codes
-    df_hts = pd.read_excel(f"{DATA_DIR}/PGA_HTS.xlsx", dtype=str) \
-        .rename(columns={"HTS Number - Full": "HsCode"})
-    df_pga = pd.read_excel(f"{DATA_DIR}/PGA_codes.xlsx")
-    pga_hts = (
-        df_hts.merge(df_pga, how="right",
-                     left_on=["PGA Name Code","PGA Flag Code","PGA Program Code"],
-                     right_on=["Agency Code","Code","Program Code"])
-        .replace("", pd.NA).dropna(axis=1, how="all")
-    )
-    pga_hts = pga_hts[pga_hts["HsCode"] == target].to_dict(orient="records")
-
-    # HS Rules
-    df_rules = pd.read_excel(f"{DATA_DIR}/hs_codes.xlsx")
-    df_rules["HsCode"] = df_rules["HsCode"].astype(str)
-    df_rules["Chapter"] = df_rules["HsCode"].str[:2].str.zfill(2)
-    df_rules["Header"] = df_rules["HsCode"].str[:4]
-    hs_rules = df_rules[df_rules["HsCode"].str.startswith(target)]
-    if hs_rules.empty:
-        hs_rules = df_rules[df_rules["HsCode"].str.startswith(target[:4])]
-    if hs_rules.empty:
-        hs_rules = df_rules[df_rules["Chapter"] == chapter_key]
-    hs_rules = hs_rules.replace("", pd.NA).dropna(axis=1, how="all") \
-        .to_dict(orient="records")
-
-    # Build a unique set of only valid HTTP(S) links
-    links = set()
-    for rec in pga_hts:
-        for col in ("TextLink", "Website Link", "CFR"):
-            raw = rec.get(col)
-            if raw is None or pd.isna(raw):
-                continue
-            for url in str(raw).split():
-                if is_valid_url(url):
-                    links.add(url)
+    # Reference data from the shared compliance engine; first call loads the workbooks off the event loop
+    result = await asyncio.to_thread(get_engine().lookup, req.hs_code)
 
+    deadline = Deadline(LOOKUP_DEADLINE_SECONDS)
+    priority = BULK if req.bulk else INTERACTIVE
     requirements = []
-    for url in sorted(links):
+    for url in result["links"]:
+        fallback_key = (url, req.name, req.description)
         try:
-            page_text = requests.get(url, timeout=10).text
-            prompt = (
-                f"Product Name: {req.name or 'N/A'}\n"
-                f"Product Description: {req.description or 'N/A'}\n\n"
-                "From this regulatory page, list each required document and its conditions.\n\n"
-                f"Page content:\n{page_text}"
-            )
-            resp = openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "system", "content": "You are a customs compliance expert understanding how the participate government agencies work. Able to identify and describe the compliance needs for a given product."},
-                          {"role": "user", "content": prompt}]
-            )
-            raw = resp.choices[0].message.content
-            requirements.append({
+            page_text = await run_with_deadline(deadline, fetch_flight, url, fetch_page, url)
+            page = clean_page(page_text)
+            if not page.chunks:
+                raise ValueError("No readable text on page")
+            chunks = page.chunks
+            prompt_chars = {"raw": len(page_text), "clean": page.clean_chars, "chunks": len(chunks),
+                            "truncated": page.truncated, "dropped": page.dropped_chars}
+            logger.info("Prompt size for %s: %d -> %d chars in %d chunk(s)",
+                        url, prompt_chars["raw"], prompt_chars["clean"], prompt_chars["chunks"])
+            answers = []
+            for chunk in chunks:
+                prompt = (
+                    f"Product Name: {req.name or 'N/A'}\n"
+                    f"Product Description: {req.description or 'N/A'}\n\n"
+                    "From this regulatory page, list each required document and its conditions.\n\n"
+                    f"Page content:\n{chunk}"
+                )
+                answers.append(await extract_with_deadline(deadline, prompt, priority))
+            raw = "\n\n".join(answers)
+            requirement = {
                 "url": url,
                 "raw_response": raw,
-                "parsed_requirements": raw  # use identical for now
-            })
+                "parsed_requirements": raw,  # use identical for now
+                "prompt_chars": prompt_chars
+            }
+            last_good_requirements.pop(fallback_key, None)
+            last_good_requirements[fallback_key] = requirement
+            if len(last_good_requirements) > LAST_GOOD_SIZE:
+                last_good_requirements.pop(next(iter(last_good_requirements)))
+            requirements.append(requirement)
         except Exception as e:
-            requirements.append({"url": url, "error": str(e)})
+            if isinstance(e, (CircuitOpenError, DeadlineExceeded)):
+                logger.warning("Skipping %s: %s", url, e)
+            cached = last_good_requirements.get(fallback_key)
+            if cached:
+                requirements.append({**cached, "stale": True, "error": str(e)})
+            else:
+                requirements.append({"url": url, "error": str(e)})
 
-    return {
-        "hs_chapters": chapters,
-        "pga_hts": pga_hts,
-        "hs_rules": hs_rules,
+    # Engine records carry NaN for empty cells, which FastAPI's JSON encoder rejects
+    return Response(payload.dumps({
+        "hs_chapters": result["hs_chapters"],
+        "pga_hts": result["pga_hts"],
+        "hs_rules": result["hs_rules"],
         "pga_requirements": requirements
-    }
+    }), media_type="application/json")
+
+
+@app.post("/lookup-batch")
+async def lookup_batch(req: BatchLookupRequest):
+    # Reference data and PGA flags only; no page fetches or LLM calls
+    results = await asyncio.to_thread(get_engine().lookup_many, req.hs_codes)
+    return Response(payload.dumps(results), media_type="application/json")
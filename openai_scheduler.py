@@ -0,0 +1,137 @@
+# openai_scheduler.py
+# Local admission control for OpenAI calls: request/token per-minute budgets, priority lanes and 429 retries.
+import heapq
+import itertools
+import random
+import threading
+import time
+
+INTERACTIVE = 0
+BULK = 1
+LANES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+
+class SchedulerTimeout(Exception):
+    pass
+
+
+def is_rate_limited(error):
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def estimate_tokens(messages, completion_tokens=500):
+    # ~4 characters per token plus room for the answer; only used for budgeting
+    return sum(len(m.get("content") or "") for m in messages) // 4 + completion_tokens
+
+
+class _Bucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount):
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimitScheduler:
+    def __init__(self, requests_per_minute, tokens_per_minute, max_retries=4, base_delay=0.5, max_delay=20.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._admitted = {lane: 0 for lane in LANES}
+        self._wait_total = {lane: 0.0 for lane in LANES}
+        self._wait_max = {lane: 0.0 for lane in LANES}
+        self._retries = 0
+        self._rate_limited = 0
+
+    def acquire(self, tokens, priority=INTERACTIVE, deadline=None):
+        """Block until this call is at the head of the queue and both budgets have room.
+
+        `deadline` is an absolute time.monotonic() value; SchedulerTimeout is raised once it passes.
+        """
+        started = time.monotonic()
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._requests.refill(now)
+                    self._tokens.refill(now)
+                    delay = max(self._requests.wait_for(1), self._tokens.wait_for(tokens))
+                    if self._queue[0] == ticket and delay == 0:
+                        break
+                    if deadline is not None:
+                        left = deadline - now
+                        if left <= 0:
+                            raise SchedulerTimeout("Timed out waiting for OpenAI rate budget")
+                        delay = min(delay, left) if delay else left
+                    self._cond.wait(delay or None)
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._requests.take(1)
+            self._tokens.take(tokens)
+            waited = time.monotonic() - started
+            self._admitted[priority] += 1
+            self._wait_total[priority] += waited
+            self._wait_max[priority] = max(self._wait_max[priority], waited)
+            self._cond.notify_all()
+
+    def call(self, fn, *args, tokens=1000, priority=INTERACTIVE, deadline=None, **kwargs):
+        """Run fn under the budgets, retrying provider 429s with jittered exponential backoff.
+
+        With a `deadline` (absolute time.monotonic()), neither queueing nor a backoff sleep runs past it;
+        the last 429 is re-raised instead of retrying for a caller that has already given up.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority, deadline)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                # full jitter: sleep a random amount up to the exponential cap
+                backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                with self._cond:
+                    self._rate_limited += 1
+                    if attempt >= self.max_retries:
+                        raise
+                    if deadline is not None and time.monotonic() + backoff >= deadline:
+                        raise
+                    self._retries += 1
+                time.sleep(backoff)
+                attempt += 1
+
+    def stats(self):
+        with self._cond:
+            depth = {name: 0 for name in LANES.values()}
+            for priority, _ in self._queue:
+                depth[LANES[priority]] += 1
+            return {
+                "queue_depth": depth,
+                "admitted": {LANES[p]: n for p, n in self._admitted.items()},
+                "wait_seconds_avg": {LANES[p]: (self._wait_total[p] / n if n else 0.0)
+                                     for p, n in self._admitted.items()},
+                "wait_seconds_max": {LANES[p]: w for p, w in self._wait_max.items()},
+                "retries": self._retries,
+                "rate_limited": self._rate_limited,
+            }
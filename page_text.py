@@ -0,0 +1,161 @@
+# page_text.py
+# Turns a raw regulatory HTML page into the short plain-text chunks we send to the LLM.
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from html.parser import HTMLParser
+
+# Page chrome whose content is never useful for the document-requirements prompt.
+# <form> and <header> are not here: WebForms sites wrap the whole body in <form>, and headers carry section titles.
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "nav", "footer", "aside", "button", "select", "iframe"}
+# Used when skipping chrome leaves nothing (e.g. an unclosed <nav> swallowing the rest of the page)
+NON_TEXT_TAGS = {"script", "style", "noscript", "template", "svg"}
+# Tags that end a block of text
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "table", "tr", "td", "th", "br", "hr",
+              "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "dd", "dt", "dl"}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+
+# Blocks mentioning any of these (or a § citation) are kept; everything else is dropped when at least one block matches
+RELEVANT_TERMS = re.compile(
+    r"\b(document|documentation|certificat|permit|licen[cs]e|registration|registered|declaration|notice|"
+    r"prior notice|label|requir|must|shall|import|entry|submit|record|form\b|approval|exempt|inspect)|§",
+    re.IGNORECASE)
+# Boilerplate lines found on most agency sites; a block is dropped only when it is nothing but one of these,
+# so "Print the completed form..." or "Menu labeling must..." are kept
+BOILERPLATE = re.compile(
+    r"^(skip to (main )?content|an official website of the united states government|here[’']?s how you know|"
+    r"share|print|back to top|menu|search|sign in|log in|cookies?|privacy policy|accessibility|contact us)\W*$",
+    re.IGNORECASE)
+
+MAX_CHUNK_CHARS = 12000  # roughly 3k tokens per chunk
+MAX_CHUNKS = 3  # upper bound on LLM calls per page
+CACHE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+# chunks: text sent to the LLM; clean_chars/dropped_chars: cleaned text kept vs. cut off by MAX_CHUNKS
+CleanedPage = namedtuple("CleanedPage", ["chunks", "clean_chars", "dropped_chars", "truncated"])
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self, skip_tags=SKIP_TAGS):
+        super().__init__(convert_charrefs=True)
+        self.skip_tags = skip_tags
+        self.blocks = []
+        self._current = []
+        self._skip_depth = 0
+        self._heading = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self._skip_depth += 1
+            return
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in HEADING_TAGS:
+            self._heading = True
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags:
+            if self._skip_depth:
+                self._skip_depth -= 1
+            return
+        if tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._current.append(data)
+
+    def _flush(self):
+        text = " ".join("".join(self._current).split())
+        self._current = []
+        if text:
+            self.blocks.append(("heading" if self._heading else "text", text))
+        self._heading = False
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def extract_blocks(html, skip_tags=SKIP_TAGS):
+    parser = _TextExtractor(skip_tags)
+    parser.feed(html)
+    parser.close()
+    return [(kind, text) for kind, text in parser.blocks if not BOILERPLATE.match(text)]
+
+
+def select_relevant(blocks):
+    # Keep matching blocks plus the heading they sit under; fall back to the whole page if nothing matches
+    selected = []
+    last_heading = None
+    for kind, text in blocks:
+        if kind == "heading":
+            last_heading = text
+            continue
+        if RELEVANT_TERMS.search(text):
+            if last_heading:
+                selected.append(last_heading)
+                last_heading = None
+            selected.append(text)
+    if not selected:
+        selected = [text for _, text in blocks]
+    return selected
+
+
+def chunk_text(paragraphs, max_chars=MAX_CHUNK_CHARS):
+    chunks = []
+    current = ""
+    for para in paragraphs:
+        while len(para) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:max_chars])
+            para = para[max_chars:]
+        if current and len(current) + len(para) + 2 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def clean_page(html):
+    """Return the relevant text of an HTML page as a CleanedPage of prompt-sized chunks, cached by content hash.
+
+    Falls back to the page's full text when chrome removal leaves nothing; `chunks` is empty only if the page
+    has no readable text at all.
+    """
+    key = hashlib.sha256(html.encode("utf-8", "replace")).hexdigest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    blocks = extract_blocks(html) or extract_blocks(html, NON_TEXT_TAGS)
+    chunks = chunk_text(select_relevant(blocks), MAX_CHUNK_CHARS)
+    kept = tuple(chunks[:MAX_CHUNKS])
+    clean_chars = sum(len(c) for c in kept)
+    dropped_chars = sum(len(c) for c in chunks[MAX_CHUNKS:])
+    page = CleanedPage(kept, clean_chars, dropped_chars, dropped_chars > 0)
+    if page.truncated:
+        logger.warning("Page text truncated to %d chunk(s): kept %d chars, dropped %d",
+                       MAX_CHUNKS, clean_chars, dropped_chars)
+
+    with _cache_lock:
+        _cache[key] = page
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return page
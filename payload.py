@@ -0,0 +1,100 @@
+# payload.py
+# Views, field projection and JSON encoding for the shipment API response.
+import hashlib
+import json
+import math
+
+try:
+    import orjson
+except ImportError:  # plain json fallback, NaN is sanitised by hand
+    orjson = None
+
+VIEWS = ("flags", "summary", "full")
+FLAG_FIELDS = ("status", "entry_type", "fallback_reason", "hts_code", "pga_flags")
+REFERENCE_BLOCKS = ("hs_chapters", "pga_hts", "hs_rules")
+
+
+def _default(obj):
+    # pandas leaves pd.NA / NaT / numpy scalars in to_dict records
+    if type(obj).__name__ in ("NAType", "NaTType"):
+        return None
+    if hasattr(obj, "item"):
+        value = obj.item()
+        return None if isinstance(value, float) and math.isnan(value) else value
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _sanitize(obj):
+    if isinstance(obj, dict):
+        return {str(k): _sanitize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_sanitize(v) for v in obj]
+    if isinstance(obj, float):
+        return None if math.isnan(obj) or math.isinf(obj) else obj
+    if obj is None or isinstance(obj, (str, int, bool)):
+        return obj
+    return _sanitize(_default(obj))
+
+
+def dumps(obj):
+    """Encode to JSON bytes, writing NaN and other pandas missing values as null."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_sanitize(obj), separators=(",", ":")).encode("utf-8")
+
+
+def _digest(body):
+    return hashlib.sha256(body).hexdigest()[:16]
+
+
+def reference_id(block, hs_code, data):
+    """ID for a reference block: which block, for which HS code, and a hash of its content.
+
+    Any worker can rebuild the block from the compliance engine, so nothing has to be stored; the hash
+    part changes (and doubles as the ETag) when the reference data changes.
+    """
+    return f"{block}:{hs_code}:{_digest(dumps(data))}"
+
+
+def resolve_reference(ref_id, lookup):
+    """Rebuild the JSON body for `ref_id` with `lookup(hs_code)`; None if the ID is malformed or out of date."""
+    block, _, rest = ref_id.partition(":")
+    hs_code, _, digest = rest.rpartition(":")
+    if block not in REFERENCE_BLOCKS or not hs_code or not digest:
+        return None
+    body = dumps(lookup(hs_code)[block])
+    if _digest(body) != digest:
+        return None
+    return body
+
+
+def parse_fields(raw):
+    if not raw:
+        return None
+    return [f.strip() for f in raw.split(",") if f.strip()]
+
+
+def shape_response(response, view="full", fields=None):
+    """Cut a full shipment response down to the requested view, then keep only `fields` if given."""
+    if view not in VIEWS:
+        raise ValueError(f"Unknown view '{view}', expected one of: {', '.join(VIEWS)}")
+
+    if view == "full":
+        shaped = dict(response)
+    else:
+        shaped = {key: response.get(key) for key in FLAG_FIELDS}
+        if view == "summary":
+            pga = response.get("pga_full_response") or {}
+            shaped["references"] = {block: reference_id(block, response.get("hts_code"), pga.get(block) or [])
+                                     for block in REFERENCE_BLOCKS}
+            shaped["pga_requirements"] = [
+                {key: req.get(key) for key in ("url", "parsed_requirements", "error", "stale") if key in req}
+                for req in pga.get("pga_requirements") or []
+            ]
+            shaped["tracking_number"] = (response.get("shipment") or {}).get("tracking_number")
+
+    if fields:
+        shaped = {key: shaped[key] for key in fields if key in shaped}
+    return shaped
@@ -0,0 +1,75 @@
+# singleflight.py
+# In-process request coalescing: concurrent callers asking for the same key share one in-flight call.
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._requests = 0
+        self._executions = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) once per key for all threads that ask while it is in flight."""
+        with self._lock:
+            self._requests += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executions += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) once per key for all coroutines that ask while it is in flight."""
+        with self._lock:
+            self._requests += 1
+            task = self._tasks.get(key)
+            if task is None:
+                task = asyncio.ensure_future(fn(*args, **kwargs))
+                self._tasks[key] = task
+                self._executions += 1
+                task.add_done_callback(lambda _t, k=key: self._forget(k, _t))
+        # shield so one cancelled caller does not cancel the work shared with the others
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "executions": self._executions,
+                "saved": self._requests - self._executions,
+                "in_flight": len(self._calls) + len(self._tasks),
+            }
@@ -0,0 +1,225 @@
+"""Pins ComplianceEngine.lookup against the per-app pipelines it replaced, on the bundled data/ workbooks.
+
+The legacy functions below are the pre-engine code from app.py (lookup_pga_requirements) and main.py
+(lookup), reduced to their reference-data part. Deliberate divergences, all following the Flask copy:
+
+* PGA_HTS is left-merged onto PGA_codes (main.py used a right merge). For a given HS code the right merge
+  only dropped the PGA_HTS rows without a matching PGA code; the engine keeps them.
+* hs_codes.xlsx is read across all sheets (main.py read only the first).
+* pga_flags keep first-seen order instead of set order.
+
+data/ ships without hs_codes.xlsx, so a two-sheet fixture workbook is built from hs_codes_old.xlsx.
+"""
+import json
+import os
+import shutil
+import threading
+
+import pandas as pd
+import pytest
+
+import payload
+from compliance_engine import ComplianceEngine, is_valid_url
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUNDLED_DIR = os.path.join(ROOT_DIR, "data")
+
+NOT_IN_PGA_HTS = ["6109100010", "8517620090", "9999999999", "3408000000", "3401"]
+
+
+@pytest.fixture(scope="module")
+def data_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("data")
+    for name in ("HS_Chapters_lookup.xlsx", "PGA_HTS.xlsx", "PGA_codes.xlsx"):
+        shutil.copy(os.path.join(BUNDLED_DIR, name), path / name)
+
+    chapter_34 = pd.read_excel(os.path.join(BUNDLED_DIR, "hs_codes_old.xlsx"))
+    chapter_34[["Topic", "TextLink"]] = chapter_34[["Topic", "TextLink"]].astype(object)
+    chapter_34.loc[chapter_34["HsCode"] == 3403, ["Topic", "TextLink"]] = ["Lubricants", "https://www.cpsc.gov/"]
+    chapter_61 = chapter_34.iloc[:2].copy()
+    chapter_61["HsCode"] = [6109, 6110]
+    chapter_61["Topic"] = ["T-shirts", "Sweaters"]
+    with pd.ExcelWriter(path / "hs_codes.xlsx") as writer:
+        chapter_34.to_excel(writer, sheet_name="HTS Chapter 34", index=False)
+        chapter_61.to_excel(writer, sheet_name="HTS Chapter 61", index=False)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def engine(data_dir):
+    return ComplianceEngine(data_dir)
+
+
+def pga_codes():
+    return sorted(pd.read_excel(os.path.join(BUNDLED_DIR, "PGA_HTS.xlsx"), dtype=str)["HTS Number - Full"].unique())
+
+
+def normalize(value):
+    # NaN / pd.NA / numpy scalars compare equal once they go through the API encoder
+    return json.loads(payload.dumps(value))
+
+
+def legacy_links(pga_hts):
+    links = set()
+    for rec in pga_hts:
+        for col in ("TextLink", "Website Link", "CFR"):
+            raw = rec.get(col)
+            if raw is None or pd.isna(raw):
+                continue
+            for url in str(raw).split():
+                if is_valid_url(url):
+                    links.add(url)
+    return sorted(links)
+
+
+def legacy_rules(df_rules, target, chapter_key):
+    df_rules["HsCode"] = df_rules["HsCode"].astype(str)
+    df_rules["Chapter"] = df_rules["HsCode"].str[:2].str.zfill(2)
+    df_rules["Header"] = df_rules["HsCode"].str[:4]
+    hs_rules = df_rules[df_rules["HsCode"].str.startswith(target)]
+    if hs_rules.empty:
+        hs_rules = df_rules[df_rules["HsCode"].str.startswith(target[:4])]
+    if hs_rules.empty:
+        hs_rules = df_rules[df_rules["Chapter"] == chapter_key]
+    return hs_rules.replace("", pd.NA).dropna(axis=1, how="all").to_dict(orient="records")
+
+
+def legacy_lookup(data_dir, target, merge, all_sheets):
+    df_chapters = pd.read_excel(os.path.join(data_dir, "HS_Chapters_lookup.xlsx"))
+    df_chapters["Chapter"] = df_chapters["Chapter"].astype(str).str.zfill(2)
+    df_chapters = df_chapters.ffill().bfill()
+    chapter_key = target[:2].zfill(2)
+    chapters = df_chapters[df_chapters["Chapter"] == chapter_key] \
+        .replace("", pd.NA).dropna(axis=1, how="all") \
+        .to_dict(orient="records")
+
+    df_hts = pd.read_excel(os.path.join(data_dir, "PGA_HTS.xlsx"), dtype=str) \
+        .rename(columns={"HTS Number - Full": "HsCode"})
+    df_pga = pd.read_excel(os.path.join(data_dir, "PGA_codes.xlsx"))
+    pga_hts = (
+        df_hts.merge(df_pga, how=merge,
+                     left_on=["PGA Name Code", "PGA Flag Code", "PGA Program Code"],
+                     right_on=["Agency Code", "Code", "Program Code"])
+        .replace("", pd.NA).dropna(axis=1, how="all")
+    )
+    pga_hts = pga_hts[pga_hts["HsCode"] == target].to_dict(orient="records")
+
+    if all_sheets:
+        sheets = pd.read_excel(os.path.join(data_dir, "hs_codes.xlsx"), sheet_name=None)
+        df_rules = pd.concat(sheets.values(), ignore_index=True)
+    else:
+        df_rules = pd.read_excel(os.path.join(data_dir, "hs_codes.xlsx"))
+    hs_rules = legacy_rules(df_rules, target, chapter_key)
+
+    pga_flags = [rec.get("PGA Name Code") for rec in pga_hts if rec.get("PGA Name Code")]
+    return {"hs_chapters": chapters, "pga_hts": pga_hts, "hs_rules": hs_rules, "links": legacy_links(pga_hts),
+            "pga_flags": list(set(pga_flags))}
+
+
+def legacy_flask(data_dir, target):
+    return legacy_lookup(data_dir, target, merge="left", all_sheets=True)
+
+
+def legacy_fastapi(data_dir, target):
+    return legacy_lookup(data_dir, target, merge="right", all_sheets=False)
+
+
+def sort_records(records):
+    return sorted(records, key=lambda rec: json.dumps(rec, sort_keys=True))
+
+
+@pytest.mark.parametrize("hs_code", pga_codes() + NOT_IN_PGA_HTS)
+def test_matches_flask_pipeline(engine, data_dir, hs_code):
+    result = engine.lookup(hs_code)
+    legacy = legacy_flask(data_dir, hs_code)
+    for block in ("hs_chapters", "pga_hts", "hs_rules", "links"):
+        assert normalize(result[block]) == normalize(legacy[block]), block
+    assert set(result["pga_flags"]) == set(legacy["pga_flags"])
+    assert result["pga_flags"] == list(dict.fromkeys(rec["PGA Name Code"] for rec in legacy["pga_hts"]))
+
+
+@pytest.mark.parametrize("hs_code", pga_codes() + NOT_IN_PGA_HTS)
+def test_fastapi_pipeline_divergence(engine, data_dir, hs_code):
+    result = engine.lookup(hs_code)
+    legacy = legacy_fastapi(data_dir, hs_code)
+    assert normalize(result["hs_chapters"]) == normalize(legacy["hs_chapters"])
+
+    # Right merge == left merge minus the rows without a matching PGA code (row order may differ)
+    matched = [rec for rec in result["pga_hts"] if not pd.isna(rec.get("Agency Code"))]
+    assert sort_records(normalize(matched)) == sort_records(normalize(legacy["pga_hts"]))
+    assert set(legacy["links"]) <= set(result["links"])
+
+    # First-sheet-only rules agree whenever the first sheet (chapter 34) covers the code
+    if hs_code.startswith("34"):
+        assert normalize(result["hs_rules"]) == normalize(legacy["hs_rules"])
+
+
+def test_all_sheets_are_read(engine, data_dir):
+    assert [rec["Topic"] for rec in engine.lookup("6109100010")["hs_rules"]] == ["T-shirts"]
+    assert legacy_fastapi(data_dir, "6109100010")["hs_rules"] == []
+
+
+def test_lookup_many_and_copies(engine):
+    batch = engine.lookup_many(["3403115000", 3403115000, "6109100010"])
+    assert list(batch) == ["3403115000", "6109100010"]
+    assert batch["3403115000"] == engine.lookup("3403115000")
+
+    batch["3403115000"]["pga_hts"][0]["PGA Name Code"] = "changed"
+    assert engine.lookup("3403115000")["pga_hts"][0]["PGA Name Code"] != "changed"
+
+
+def test_concurrent_first_load(data_dir):
+    engine = ComplianceEngine(data_dir)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(engine.lookup("3403115000"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 8
+    assert all(normalize(r) == normalize(results[0]) for r in results)
+
+
+@pytest.fixture
+def fastapi_client(engine, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+    monkeypatch.setattr(main, "get_engine", lambda: engine)
+    return TestClient(main.app)
+
+
+def test_lookup_batch_endpoint_encodes_missing_values(fastapi_client, engine):
+    resp = fastapi_client.post("/lookup-batch", json={"hs_codes": ["3401111000", "6109100010"]})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert list(body) == ["3401111000", "6109100010"]
+    assert body["3401111000"] == normalize(engine.lookup("3401111000"))
+
+
+def test_lookup_endpoint_encodes_missing_values(fastapi_client, engine, monkeypatch):
+    import main
+
+    def unavailable(url, timeout):
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(main, "fetch_page", unavailable)
+    resp = fastapi_client.post("/lookup", json={"hs_code": "3401111000"})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["pga_hts"] == normalize(engine.lookup("3401111000")["pga_hts"])
+    assert all(req["error"] == "offline" for req in body["pga_requirements"])
+
+
+def test_flask_lookup_batch_endpoint(engine, monkeypatch, tmp_path):
+    import app
+    monkeypatch.setattr(app, "get_engine", lambda: engine)
+    monkeypatch.setattr(app, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(app, "CUSTOMERS_FILE", str(tmp_path / "customers.json"))
+    monkeypatch.setattr(app, "_storage_ready", False)
+    client = app.app.test_client()
+
+    resp = client.post("/api/lookup-batch", json={"hs_codes": ["3401.11.1000", "6109100010"]})
+    assert resp.status_code == 200
+    assert resp.get_json() == normalize(engine.lookup_many(["3401111000", "6109100010"]))
+    assert client.post("/api/lookup-batch", json={}).status_code == 400
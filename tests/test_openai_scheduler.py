@@ -0,0 +1,175 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+import openai_scheduler
+from fake_openai import FakeOpenAI
+from openai_scheduler import BULK, INTERACTIVE, RateLimitScheduler, SchedulerTimeout
+from resilience import BreakerRegistry, CircuitOpenError, Deadline
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    server = FakeOpenAI().start()
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(main, "_openai_client", None)
+    monkeypatch.setattr(main, "breakers", BreakerRegistry())
+    yield server
+    server.stop()
+
+
+def use_scheduler(monkeypatch, **kwargs):
+    scheduler = RateLimitScheduler(**{"requests_per_minute": 6000, "tokens_per_minute": 10 ** 7, **kwargs})
+    monkeypatch.setattr(main, "llm_scheduler", scheduler)
+    return scheduler
+
+
+def drain_requests(scheduler):
+    # Use up the whole request budget so the next call has to wait for a refill
+    for _ in range(int(scheduler._requests.capacity)):
+        scheduler.acquire(0)
+
+
+def test_429s_are_retried_with_jittered_backoff(monkeypatch, fake_openai):
+    scheduler = use_scheduler(monkeypatch, base_delay=0.01)
+    caps = []
+    real_uniform = openai_scheduler.random.uniform
+    monkeypatch.setattr(openai_scheduler.random, "uniform", lambda a, b: caps.append((a, b)) or real_uniform(a, b))
+    fake_openai.statuses = [429, 429]
+
+    assert main.extract_requirements("prompt", INTERACTIVE, 5) == "Fake answer"
+    assert len(fake_openai.requests) == 3
+    assert caps == [(0, 0.01), (0, 0.02)]
+    stats = scheduler.stats()
+    assert stats["retries"] == 2
+    assert stats["rate_limited"] == 2
+
+
+def test_retries_stop_at_the_deadline(monkeypatch, fake_openai):
+    use_scheduler(monkeypatch, base_delay=5, max_retries=10)
+    monkeypatch.setattr(openai_scheduler.random, "uniform", lambda a, b: b)
+    fake_openai.statuses = [429] * 10
+
+    started = time.monotonic()
+    with pytest.raises(Exception) as error:
+        main.extract_requirements("prompt", INTERACTIVE, 1)
+    assert openai_scheduler.is_rate_limited(error.value)
+    assert time.monotonic() - started < 1
+    assert len(fake_openai.requests) == 1
+
+
+def test_scheduler_timeouts_do_not_trip_openai_breaker(monkeypatch, fake_openai):
+    scheduler = use_scheduler(monkeypatch, requests_per_minute=60)
+    drain_requests(scheduler)
+    for _ in range(6):
+        with pytest.raises(SchedulerTimeout):
+            main.extract_requirements("prompt", BULK, 0.01)
+    assert main.breakers.get(main.OPENAI_HOST).state == "closed"
+    assert fake_openai.requests == []
+
+
+def test_interactive_calls_go_before_bulk(monkeypatch, fake_openai):
+    scheduler = use_scheduler(monkeypatch, requests_per_minute=600)  # refills one request every 0.1s
+    drain_requests(scheduler)
+
+    threads = []
+    for name, priority in (("bulk-1", BULK), ("bulk-2", BULK), ("interactive-1", INTERACTIVE),
+                           ("interactive-2", INTERACTIVE)):
+        thread = threading.Thread(target=main.extract_requirements, args=(name, priority, 5))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.01)
+
+    depth = scheduler.stats()["queue_depth"]
+    assert depth == {"interactive": 2, "bulk": 2}
+    for thread in threads:
+        thread.join()
+
+    assert [r.rsplit("\n", 1)[-1] for r in fake_openai.requests] == \
+        ["interactive-1", "interactive-2", "bulk-1", "bulk-2"]
+    stats = scheduler.stats()
+    assert stats["queue_depth"] == {"interactive": 0, "bulk": 0}
+    assert stats["wait_seconds_max"]["bulk"] >= stats["wait_seconds_max"]["interactive"] > 0.05
+
+
+def test_request_budget_throttles(monkeypatch):
+    scheduler = RateLimitScheduler(requests_per_minute=600, tokens_per_minute=10 ** 7)
+    drain_requests(scheduler)
+    started = time.monotonic()
+    scheduler.acquire(0)
+    assert time.monotonic() - started >= 0.08
+
+
+def test_token_budget_throttles():
+    scheduler = RateLimitScheduler(requests_per_minute=6000, tokens_per_minute=6000)  # 100 tokens/s
+    scheduler.acquire(6000)
+    started = time.monotonic()
+    scheduler.acquire(10)
+    waited = time.monotonic() - started
+    assert 0.08 <= waited < 1
+    assert scheduler.stats()["wait_seconds_max"]["interactive"] >= 0.08
+
+
+def test_queue_wait_respects_deadline():
+    scheduler = RateLimitScheduler(requests_per_minute=60, tokens_per_minute=10 ** 7)
+    drain_requests(scheduler)
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire(0, BULK, deadline=time.monotonic() + 0.05)
+    assert scheduler.stats()["queue_depth"] == {"interactive": 0, "bulk": 0}
+
+
+def test_client_errors_do_not_trip_openai_breaker(monkeypatch, fake_openai):
+    use_scheduler(monkeypatch)
+    monkeypatch.setattr(main, "breakers", BreakerRegistry(failure_threshold=2))
+    fake_openai.statuses = [400, 401, 400]
+    for _ in range(3):
+        with pytest.raises(Exception) as error:
+            main.extract_requirements("prompt", INTERACTIVE, 5)
+        assert error.value.status_code in (400, 401)
+    assert main.breakers.get(main.OPENAI_HOST).state == "closed"
+    assert main.extract_requirements("prompt", INTERACTIVE, 5) == "Fake answer"
+
+
+def test_server_errors_trip_openai_breaker(monkeypatch, fake_openai):
+    use_scheduler(monkeypatch)
+    monkeypatch.setattr(main, "breakers", BreakerRegistry(failure_threshold=2))
+    fake_openai.statuses = [500, 503]
+    for _ in range(2):
+        with pytest.raises(Exception):
+            main.extract_requirements("prompt", INTERACTIVE, 5)
+    with pytest.raises(CircuitOpenError):
+        main.extract_requirements("prompt", INTERACTIVE, 5)
+    assert len(fake_openai.requests) == 2
+
+
+def test_queued_bulk_calls_do_not_block_interactive_or_fetches(monkeypatch):
+    # One worker per lane, and every bulk extraction stuck waiting for budget
+    monkeypatch.setattr(main, "llm_executors", {INTERACTIVE: ThreadPoolExecutor(1), BULK: ThreadPoolExecutor(1)})
+    release = threading.Event()
+
+    def extract(prompt, priority, timeout):
+        if priority == BULK:
+            release.wait(5)
+        return f"answer to {prompt}"
+
+    monkeypatch.setattr(main, "extract_requirements", extract)
+
+    async def scenario():
+        # A default executor small enough that four blocked bulk calls would fill it if they ran there
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(2))
+        bulk = [asyncio.ensure_future(main.extract_with_deadline(Deadline(5), f"bulk {i}", BULK)) for i in range(4)]
+        await asyncio.sleep(0.05)
+        try:
+            page = await asyncio.wait_for(asyncio.to_thread(lambda: "page"), 1)
+            answer = await asyncio.wait_for(main.extract_with_deadline(Deadline(5), "lookup", INTERACTIVE), 1)
+        finally:
+            release.set()
+        await asyncio.gather(*bulk)
+        return page, answer
+
+    assert asyncio.run(scenario()) == ("page", "answer to lookup")
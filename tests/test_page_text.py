@@ -0,0 +1,66 @@
+import page_text
+from page_text import clean_page
+
+
+def test_strips_chrome_and_keeps_relevant_blocks():
+    html = ("<html><head><style>p{}</style><script>var a</script></head><body>"
+            "<nav>Home Menu</nav><h2>Imports</h2><p>Importers must file prior notice.</p>"
+            "<p>Unrelated weather report.</p><footer>Contact us</footer></body></html>")
+    page = clean_page(html)
+    assert page.chunks == ("Imports\n\nImporters must file prior notice.",)
+    assert not page.truncated
+
+
+def test_form_wrapped_body_is_kept():
+    page = clean_page("<form><h1>FDA Import Program</h1><p>Importers must file prior notice for food.</p></form>")
+    assert page.chunks == ("FDA Import Program\n\nImporters must file prior notice for food.",)
+
+
+def test_header_section_title_is_kept():
+    page = clean_page("<header><h1>21 CFR 1.276 Prior notice</h1></header><p>The notice must be submitted.</p>")
+    assert page.chunks[0].startswith("21 CFR 1.276 Prior notice")
+
+
+def test_unclosed_chrome_falls_back_to_full_text():
+    page = clean_page("<nav><p>Importers must register the facility.</p>")
+    assert page.chunks == ("Importers must register the facility.",)
+
+
+def test_page_without_text_has_no_chunks():
+    assert clean_page("<html><script>var a</script></html>").chunks == ()
+
+
+def test_truncation_is_reported(monkeypatch):
+    monkeypatch.setattr(page_text, "MAX_CHUNK_CHARS", 100)
+    paragraphs = "".join(f"<p>Permit {i} is required. {'x' * 80}</p>" for i in range(5))
+    page = clean_page(paragraphs)
+    assert len(page.chunks) == page_text.MAX_CHUNKS
+    assert page.truncated
+    assert page.dropped_chars > 0
+    assert page.clean_chars == sum(len(c) for c in page.chunks)
+
+
+def test_cleaned_page_is_cached_by_content():
+    html = "<p>Import licence required.</p>"
+    assert clean_page(html) is clean_page(html)
+
+
+def test_boilerplate_only_drops_whole_blocks():
+    page = clean_page("<h2>Labeling</h2>"
+                      "<p>Menu labeling must comply with 21 CFR 101.11 for imported food.</p>"
+                      "<p>Print the completed FDA Form 2877 and submit it with the entry.</p>"
+                      "<p>Unrelated.</p>")
+    assert page.chunks == ("Labeling\n\n"
+                           "Menu labeling must comply with 21 CFR 101.11 for imported food.\n\n"
+                           "Print the completed FDA Form 2877 and submit it with the entry.",)
+
+
+def test_boilerplate_blocks_are_dropped():
+    blocks = page_text.extract_blocks("<p>Skip to main content</p><p>Print</p><p>Share:</p>"
+                                      "<p>Here’s how you know</p><p>Importers must register.</p>")
+    assert blocks == [("text", "Importers must register.")]
+
+
+def test_section_sign_marks_block_relevant():
+    page = clean_page("<p>Weather report.</p><p>See § 1.276 for details.</p>")
+    assert page.chunks == ("See § 1.276 for details.",)
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+import app
+import payload
+
+BLOCKS = {
+    "hs_chapters": [{"Section": "VI", "Chapter": "34", "Description": "Soap"}],
+    "pga_hts": [{"HsCode": "3403115000", "PGA Name Code": "CPS", "CFR": float("nan")}],
+    "hs_rules": [],
+}
+
+
+class FakeEngine:
+    def lookup(self, hs_code):
+        data = BLOCKS if hs_code == "3403115000" else {block: [] for block in BLOCKS}
+        return {**data, "links": [], "pga_flags": ["CPS"]}
+
+
+def full_response():
+    return {
+        "status": "success",
+        "entry_type": "Type 86",
+        "fallback_reason": None,
+        "hts_code": "3403115000",
+        "pga_flags": ["CPS"],
+        "pga_full_response": {**BLOCKS, "pga_requirements": [{"url": "u", "raw_response": "r",
+                                                             "parsed_requirements": "r"}]},
+        "shipment": {"tracking_number": "TRACK123"},
+    }
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "get_engine", lambda: FakeEngine())
+    # ensure_storage() runs on the first request; keep it out of the repo's data/
+    monkeypatch.setattr(app, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setitem(app.app.config, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(app, "CUSTOMERS_FILE", str(tmp_path / "customers.json"))
+    monkeypatch.setattr(app, "_storage_ready", False)
+    return app.app.test_client()
+
+
+def test_views_and_fields():
+    response = full_response()
+    assert payload.shape_response(response, "full") == response
+    assert set(payload.shape_response(response, "flags")) == set(payload.FLAG_FIELDS)
+    summary = payload.shape_response(response, "summary")
+    assert "shipment" not in summary and "pga_full_response" not in summary
+    assert summary["tracking_number"] == "TRACK123"
+    assert payload.shape_response(response, "full", ["hts_code", "missing"]) == {"hts_code": "3403115000"}
+    with pytest.raises(ValueError):
+        payload.shape_response(response, "everything")
+
+
+def test_nan_is_encoded_as_null():
+    assert json.loads(payload.dumps({"a": float("nan")})) == {"a": None}
+
+
+def test_reference_resolves_without_prior_summary(client):
+    # IDs are rebuilt from engine data, so a worker that never produced the summary can serve them
+    ref_id = payload.reference_id("pga_hts", "3403115000", BLOCKS["pga_hts"])
+    resp = client.get(f"/api/reference/{ref_id}")
+    assert resp.status_code == 200
+    assert resp.get_json() == [{"HsCode": "3403115000", "PGA Name Code": "CPS", "CFR": None}]
+    assert resp.headers["ETag"] == f'"{ref_id}"'
+
+    cached = client.get(f"/api/reference/{ref_id}", headers={"If-None-Match": f'"{ref_id}"'})
+    assert cached.status_code == 304
+
+
+def test_summary_references_match_served_blocks(client):
+    summary = payload.shape_response(full_response(), "summary")
+    for block, ref_id in summary["references"].items():
+        assert json.loads(client.get(f"/api/reference/{ref_id}").data) == json.loads(payload.dumps(BLOCKS[block]))
+
+
+def test_unknown_or_outdated_reference_is_404(client):
+    assert client.get("/api/reference/pga_hts:3403115000:0000000000000000").status_code == 404
+    assert client.get("/api/reference/bogus:3403115000:abc").status_code == 404
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+import main
+from resilience import BreakerRegistry, CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded
+
+
+class FakeResponse:
+    def __init__(self, status_code, text="ok"):
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+class FakeEngine:
+    def __init__(self, links):
+        self.links = links
+
+    def lookup(self, hs_code):
+        return {"hs_chapters": [], "pga_hts": [], "hs_rules": [], "links": list(self.links), "pga_flags": []}
+
+
+def test_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker("host", failure_threshold=2, reset_timeout=0.05)
+
+    def fail():
+        raise ValueError("down")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            breaker.call(fail)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_deadline_caps_timeouts():
+    deadline = Deadline(0.01)
+    assert deadline.timeout(10) <= 0.01
+    time.sleep(0.02)
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout(10)
+
+
+@pytest.fixture
+def fresh_breakers(monkeypatch):
+    registry = BreakerRegistry(failure_threshold=2)
+    monkeypatch.setattr(main, "breakers", registry)
+    return registry
+
+
+def test_client_errors_do_not_trip_host_breaker(monkeypatch, fresh_breakers):
+    monkeypatch.setattr(main.requests, "get", lambda url, timeout: FakeResponse(404))
+    for _ in range(5):
+        with pytest.raises(requests.HTTPError):
+            main.fetch_page("https://www.ecfr.gov/dead", 1)
+    assert fresh_breakers.for_url("https://www.ecfr.gov/live").state == "closed"
+
+
+def test_server_errors_trip_host_breaker(monkeypatch, fresh_breakers):
+    monkeypatch.setattr(main.requests, "get", lambda url, timeout: FakeResponse(503))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            main.fetch_page("https://www.ecfr.gov/a", 1)
+    with pytest.raises(CircuitOpenError):
+        main.fetch_page("https://www.ecfr.gov/b", 1)
+
+
+def test_fallback_is_scoped_to_the_product(monkeypatch, fresh_breakers):
+    url = "https://www.fda.gov/prior-notice"
+    monkeypatch.setattr(main, "get_engine", lambda: FakeEngine([url]))
+    monkeypatch.setattr(main, "last_good_requirements", {})
+    monkeypatch.setattr(main, "fetch_page", lambda url, timeout: "<p>Importers must file prior notice.</p>")
+    monkeypatch.setattr(main, "extract_requirements", lambda prompt, priority, timeout: "Prior notice")
+    client = TestClient(main.app)
+
+    first = client.post("/lookup", json={"hs_code": "1", "name": "Tea", "description": "Green tea"}).json()
+    assert first["pga_requirements"][0]["raw_response"] == "Prior notice"
+
+    def outage(url, timeout):
+        raise CircuitOpenError("Circuit open")
+
+    monkeypatch.setattr(main, "fetch_page", outage)
+    same = client.post("/lookup", json={"hs_code": "1", "name": "Tea", "description": "Green tea"}).json()
+    assert same["pga_requirements"][0]["stale"] is True
+    assert same["pga_requirements"][0]["raw_response"] == "Prior notice"
+
+    other = client.post("/lookup", json={"hs_code": "1", "name": "Lipstick", "description": "Matte"}).json()
+    assert other["pga_requirements"][0] == {"url": url, "error": "Circuit open"}
+
+
+def test_extraction_is_coalesced_per_priority_lane(monkeypatch, fresh_breakers):
+    url = "https://www.fda.gov/prior-notice"
+    monkeypatch.setattr(main, "get_engine", lambda: FakeEngine([url]))
+    monkeypatch.setattr(main, "fetch_page", lambda url, timeout: "<p>Importers must file prior notice.</p>")
+    keys = []
+
+    async def do_async(key, fn, *args):
+        keys.append(key)
+        return "Prior notice"
+
+    monkeypatch.setattr(main.extract_flight, "do_async", do_async)
+    client = TestClient(main.app)
+    client.post("/lookup", json={"hs_code": "1", "name": "Tea"})
+    client.post("/lookup", json={"hs_code": "1", "name": "Tea", "bulk": True})
+
+    assert keys[0].split(":")[1] == keys[1].split(":")[1]
+    assert keys[0] != keys[1]
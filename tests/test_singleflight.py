@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _run_concurrently(flight, key, fn, callers):
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(callers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def _slow(release, value=None, error=None):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(2)
+        if error is not None:
+            raise error
+        return value
+
+    return fn, calls
+
+
+def _wait_for_followers(flight, requests):
+    # followers have registered once the request counter reaches `requests`
+    for _ in range(200):
+        if flight.stats()["requests"] >= requests:
+            return
+        time.sleep(0.005)
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    fn, calls = _slow(release, value="page")
+    threading.Thread(target=lambda: (_wait_for_followers(flight, 5), release.set())).start()
+
+    results, errors = _run_concurrently(flight, "url", fn, 5)
+
+    assert results == ["page"] * 5 and not errors
+    assert len(calls) == 1
+    assert flight.stats() == {"requests": 5, "executions": 1, "saved": 4, "in_flight": 0}
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    boom = ValueError("fetch failed")
+    fn, calls = _slow(release, error=boom)
+    threading.Thread(target=lambda: (_wait_for_followers(flight, 3), release.set())).start()
+
+    results, errors = _run_concurrently(flight, "url", fn, 3)
+
+    assert not results
+    assert errors == [boom] * 3
+    assert len(calls) == 1
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight("test")
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.do("k", lambda: 2) == 2
+    assert flight.stats()["saved"] == 0
+
+
+def test_async_shared_task_survives_cancelled_caller():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.do_async("prompt", work))
+        second = asyncio.ensure_future(flight.do_async("prompt", work))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "answer"
+    assert len(calls) == 1
+    assert flight.stats()["saved"] == 1
+
+
+def test_async_key_is_forgotten_after_completion():
+    flight = SingleFlight("test")
+    counter = iter(range(10))
+
+    async def work():
+        await asyncio.sleep(0)
+        return next(counter)
+
+    async def scenario():
+        first = await flight.do_async("prompt", work)
+        assert flight.stats()["in_flight"] == 0
+        second = await flight.do_async("prompt", work)
+        return first, second
+
+    assert asyncio.run(scenario()) == (0, 1)
+    assert flight.stats()["executions"] == 2
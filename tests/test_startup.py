@@ -0,0 +1,66 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import + first request, per front end; override for slow CI machines
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "3.0"))
+
+# Runs in a fresh interpreter so modules imported by other tests don't hide what startup loads
+STARTUP_SCRIPT = """
+import json, os, sys, time
+
+data_dir = sys.argv[1]  # keeps ensure_storage() from creating files in the repo's data/
+started = time.perf_counter()
+import app
+flask_import = time.perf_counter() - started
+app.DATA_DIR = data_dir
+app.CUSTOMERS_FILE = os.path.join(data_dir, 'customers.json')
+app.UPLOAD_DIR = app.app.config['UPLOAD_DIR'] = os.path.join(data_dir, 'uploads')
+started = time.perf_counter()
+flask_status = app.app.test_client().get('/home').status_code
+flask_first_request = time.perf_counter() - started
+
+started = time.perf_counter()
+import main
+fastapi_import = time.perf_counter() - started
+main.DATA_DIR = data_dir
+heavy = [name for name in ('pandas', 'openpyxl', 'openai') if name in sys.modules]
+
+from fastapi.testclient import TestClient
+started = time.perf_counter()
+fastapi_status = TestClient(main.app).get('/list-data').status_code
+fastapi_first_request = time.perf_counter() - started
+
+print(json.dumps({
+    'heavy': heavy,
+    'flask': {'import': flask_import, 'first_request': flask_first_request, 'status': flask_status},
+    'fastapi': {'import': fastapi_import, 'first_request': fastapi_first_request, 'status': fastapi_status},
+}))
+"""
+
+
+def measure_startup(data_dir):
+    out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, str(data_dir)], cwd=ROOT_DIR, capture_output=True,
+                         text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_startup_does_not_load_heavy_libraries(tmp_path):
+    assert measure_startup(tmp_path)["heavy"] == []
+
+
+def test_time_to_first_request_within_budget(tmp_path):
+    timings = measure_startup(tmp_path)
+    for front_end in ("flask", "fastapi"):
+        t = timings[front_end]
+        assert t["status"] == 200
+        total = t["import"] + t["first_request"]
+        assert total < STARTUP_BUDGET_SECONDS, f"{front_end} took {total:.2f}s to first request: {t}"
+
+
+def test_startup_writes_only_to_the_given_data_dir(tmp_path):
+    measure_startup(tmp_path)
+    assert sorted(os.listdir(tmp_path)) == ["customers.json", "uploads"]
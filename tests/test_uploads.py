@@ -0,0 +1,113 @@
+import io
+import json
+import os
+
+import pytest
+
+import app
+import uploads
+
+PDF = b"%PDF-1.4 commercial invoice" + b"x" * 200_000
+
+SHIPMENT_FORM = {
+    "api_token": app.FIXED_API_KEY, "shipper_id": "SHIP123", "consignee_name": "John Doe",
+    "consignee_street_address_1": "123 Main St", "consignee_street_address_2": "", "consignee_city": "New York",
+    "consignee_region": "NY", "consignee_postal_code": "10001", "consignee_country": "USA",
+    "description": "Cotton T-shirt", "hs_code": "6109100010", "quantity": "2", "value": "50",
+    "country_of_origin": "CN", "tracking_number": "TRACK123",
+}
+
+ONBOARD_FORM = {
+    "company_name": "Example Corp", "street_address_1": "123 Business Rd", "street_address_2": "",
+    "city": "San Francisco", "region": "CA", "postal_code": "94105", "country": "USA",
+    "email": "contact@example.com", "phone": "+1-555-123-4567", "has_poa": "on",
+    "poa_expiry_date": "2025-12-31", "status": "Active",
+}
+
+
+class FakeEngine:
+    def lookup(self, hs_code):
+        return {"hs_chapters": [], "pga_hts": [], "hs_rules": [], "links": [], "pga_flags": []}
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "get_engine", lambda: FakeEngine())
+    monkeypatch.setattr(app, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setitem(app.app.config, "UPLOAD_DIR", str(tmp_path))
+    customers_file = tmp_path / "customers.json"
+    customers_file.write_text("{}")
+    monkeypatch.setattr(app, "CUSTOMERS_FILE", str(customers_file))
+    return tmp_path
+
+
+def stored_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".pdf"))
+
+
+def test_spool_hashes_as_bytes_arrive(tmp_path):
+    spool = uploads.HashingSpool(str(tmp_path), max_bytes=10)
+    spool.write(b"%PDF-")
+    assert spool.size == 5 and not spool.too_large
+    spool.write(b"123456")
+    assert spool.too_large
+    assert os.path.getsize(spool.path) == 0  # stops writing once over the limit
+    spool.discard()
+    assert os.listdir(tmp_path) == []
+
+
+def test_same_document_is_stored_once(upload_dir):
+    client = app.app.test_client()
+    data = {**SHIPMENT_FORM, "bol_file": (io.BytesIO(PDF), "bol.pdf"),
+            "commercial_invoice": (io.BytesIO(PDF), "invoice.pdf")}
+    resp = client.post("/shipment", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    assert b"Shipment submitted successfully." in resp.data
+    assert len(stored_files(upload_dir)) == 1
+    assert not [name for name in os.listdir(upload_dir) if name.startswith(".upload-")]
+
+
+def test_oversized_shipment_document_is_rejected(upload_dir, monkeypatch):
+    monkeypatch.setitem(app.app.config, "MAX_UPLOAD_BYTES", 1000)
+    client = app.app.test_client()
+    data = {**SHIPMENT_FORM, "bol_file": (io.BytesIO(PDF), "bol.pdf")}
+    resp = client.post("/shipment", data=data, content_type="multipart/form-data")
+    assert b"exceeds the 1000 byte upload limit" in resp.data
+    assert os.listdir(upload_dir) == ["customers.json"]
+
+
+def test_oversized_poa_shows_error_on_onboarding(upload_dir, monkeypatch):
+    monkeypatch.setitem(app.app.config, "MAX_UPLOAD_BYTES", 1000)
+    client = app.app.test_client()
+    data = {**ONBOARD_FORM, "poa_file": (io.BytesIO(PDF), "poa.pdf")}
+    resp = client.post("/onboard", data=data, content_type="multipart/form-data")
+    assert resp.status_code == 200
+    assert b"exceeds the 1000 byte upload limit" in resp.data
+    assert json.loads((upload_dir / "customers.json").read_text()) == {}
+    assert stored_files(upload_dir) == []
+
+
+def test_parsed_upload_is_stored_in_the_given_dir(upload_dir, tmp_path_factory):
+    target = tmp_path_factory.mktemp("stored")
+    data = {"poa_file": (io.BytesIO(PDF), "poa.pdf")}
+    with app.app.test_request_context("/onboard", method="POST", data=data, content_type="multipart/form-data"):
+        path = uploads.save_upload(app.request.files["poa_file"], str(target))
+        app.request.discard_uploads()
+    assert os.path.dirname(path) == str(target)
+    assert stored_files(target) == [os.path.basename(path)]
+    assert stored_files(upload_dir) == []
+
+
+def test_deleting_customer_keeps_shared_stored_file(upload_dir):
+    client = app.app.test_client()
+    client.post("/onboard", data={**ONBOARD_FORM, "poa_file": (io.BytesIO(PDF), "poa.pdf")},
+                content_type="multipart/form-data")
+    client.post("/shipment", data={**SHIPMENT_FORM, "bol_file": (io.BytesIO(PDF), "bol.pdf")},
+                content_type="multipart/form-data")
+    shared = stored_files(upload_dir)
+    assert len(shared) == 1
+
+    resp = client.post(f"/delete-customer/{app.FIXED_API_KEY}")
+    assert resp.status_code == 302
+    assert json.loads((upload_dir / "customers.json").read_text()) == {}
+    assert stored_files(upload_dir) == shared
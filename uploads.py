@@ -0,0 +1,155 @@
+# uploads.py
+# Streaming, content-addressed storage for uploaded shipment documents.
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))  # per file
+
+logger = logging.getLogger(__name__)
+
+# Post-processing runs off the request thread; each processor is called with the stored file path
+post_processors = []
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upload-post")
+_stats_lock = threading.Lock()
+_stats = {"stored": 0, "deduplicated": 0, "rejected": 0, "bytes_written": 0}
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    pass
+
+
+class HashingSpool:
+    """File-part target for Werkzeug's form parser: writes to a temp file in the upload directory and hashes
+    the bytes as they arrive. Past `max_bytes` it stops writing and only counts, so an oversized part never
+    fills the disk; save_upload() then rejects it."""
+
+    def __init__(self, upload_dir, max_bytes):
+        fd, self.path = tempfile.mkstemp(dir=upload_dir, prefix=".upload-")
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.too_large = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            if not self.too_large:
+                self.too_large = True
+                self._file.truncate(0)
+            return len(data)
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush/close etc. go to the temp file
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request class that streams file parts into HashingSpools under app.config['UPLOAD_DIR']."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = HashingSpool(current_app.config["UPLOAD_DIR"],
+                             current_app.config.get("MAX_UPLOAD_BYTES", MAX_UPLOAD_BYTES))
+        self.__dict__.setdefault("_upload_spools", []).append(spool)
+        return spool
+
+    def discard_uploads(self):
+        # Temp files that save_upload() did not move into place (ignored fields, errors)
+        for spool in self.__dict__.get("_upload_spools", []):
+            spool.discard()
+
+
+def check_pdf_header(path):
+    with open(path, "rb") as f:
+        if f.read(5) != b"%PDF-":
+            logger.warning("Uploaded file %s does not look like a PDF", path)
+
+
+post_processors.append(check_pdf_header)
+
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+def _post_process(path):
+    for processor in post_processors:
+        try:
+            processor(path)
+        except Exception:
+            logger.exception("Upload post-processor %s failed for %s", processor.__name__, path)
+
+
+def _store(tmp_path, upload_dir, digest, extension, size):
+    path = os.path.join(upload_dir, f"{digest}{extension}")
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        _count("deduplicated")
+        return path
+    os.replace(tmp_path, path)
+    _count("stored")
+    _count("bytes_written", size)
+    _executor.submit(_post_process, path)
+    return path
+
+
+def save_upload(file_storage, upload_dir, max_bytes=MAX_UPLOAD_BYTES):
+    """Store an uploaded file in `upload_dir` under its SHA-256 and return the path of its single stored copy.
+
+    Parts parsed by UploadRequest were already hashed and written to disk while the body arrived, so this
+    is a rename (the spool lives in app.config['UPLOAD_DIR'], normally the same directory). Any other stream
+    is copied in chunks, hashing as it goes.
+    """
+    extension = os.path.splitext(file_storage.filename or "")[1].lower()
+    stream = file_storage.stream
+    if isinstance(stream, HashingSpool):
+        if stream.too_large:
+            _count("rejected")
+            raise UploadTooLarge(f"{file_storage.filename} exceeds the {stream.max_bytes} byte upload limit")
+        stream.flush()
+        return _store(stream.path, upload_dir, stream.hexdigest(), extension, stream.size)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    _count("rejected")
+                    raise UploadTooLarge(f"{file_storage.filename} exceeds the {max_bytes} byte upload limit")
+                digest.update(chunk)
+                out.write(chunk)
+        return _store(tmp_path, upload_dir, digest.hexdigest(), extension, size)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)